@@ -3,8 +3,8 @@ Configuration settings for the AI Chat Assistant backend.
 Uses Pydantic settings for environment variable management.
 """
 
-from functools import lru_cache
-from typing import List
+from functools import cached_property, lru_cache
+from typing import FrozenSet, List
 from pydantic_settings import BaseSettings
 
 
@@ -24,12 +24,25 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = True
+    # Uvicorn worker processes outside debug. Uploaded PDFs, chat jobs and
+    # caches live in each process's memory, so raise this only when
+    # requests from a client stick to one worker.
+    workers: int = 1
     
-    @property
+    # Worker threads for blocking work Starlette offloads (file responses,
+    # upload reads, any sync handlers)
+    threadpool_tokens: int = 100
+    
+    @cached_property
     def cors_origins_list(self) -> List[str]:
-        """Parse CORS origins from comma-separated string."""
+        """Parse CORS origins from comma-separated string (computed once)."""
         return [origin.strip() for origin in self.cors_origins.split(",")]
     
+    @cached_property
+    def cors_origins_set(self) -> FrozenSet[str]:
+        """CORS origins as a frozenset, for constant-time origin checks."""
+        return frozenset(self.cors_origins_list)
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -46,35 +46,6 @@ class UIComponentType(str, Enum):
     SOURCE_CARD = "source_card"
 
 
-# ============ Request Models ============
-
-class ChatMessage(BaseModel):
-    """A single message in the chat conversation."""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    role: MessageRole
-    content: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-    citations: List["Citation"] = Field(default_factory=list)
-    ui_components: List["UIComponent"] = Field(default_factory=list)
-    tool_calls: List["ToolCall"] = Field(default_factory=list)
-
-
-class ChatRequest(BaseModel):
-    """Request body for chat endpoint."""
-    message: str = Field(..., min_length=1, max_length=4000)
-    conversation_id: Optional[str] = None
-    history: List[ChatMessage] = Field(default_factory=list)
-    pdf_ids: List[str] = Field(default_factory=list)  # PDFs to use for this conversation
-
-
-class PDFUploadResponse(BaseModel):
-    """Response after PDF upload."""
-    pdf_id: str
-    filename: str
-    page_count: int
-    status: str = "processed"
-
-
 # ============ Citation Models ============
 
 class Citation(BaseModel):
@@ -141,6 +112,35 @@ class UIComponent(BaseModel):
     data: Union[InfoCardData, DataTableData, ChartData, SourceCard]
 
 
+# ============ Request Models ============
+
+class ChatMessage(BaseModel):
+    """A single message in the chat conversation."""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    role: MessageRole
+    content: str
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    citations: List[Citation] = Field(default_factory=list)
+    ui_components: List[UIComponent] = Field(default_factory=list)
+    tool_calls: List[ToolCall] = Field(default_factory=list)
+
+
+class ChatRequest(BaseModel):
+    """Request body for chat endpoint."""
+    message: str = Field(..., min_length=1, max_length=4000)
+    conversation_id: Optional[str] = None
+    history: List[ChatMessage] = Field(default_factory=list)
+    pdf_ids: List[str] = Field(default_factory=list)  # PDFs to use for this conversation
+
+
+class PDFUploadResponse(BaseModel):
+    """Response after PDF upload."""
+    pdf_id: str
+    filename: str
+    page_count: int
+    status: str = "processed"
+
+
 # ============ Stream Event Models ============
 
 class StreamEvent(BaseModel):
@@ -207,7 +207,3 @@ class ErrorResponse(BaseModel):
     error: str
     detail: Optional[str] = None
     code: str = "UNKNOWN_ERROR"
-
-
-# Update forward references
-ChatMessage.model_rebuild()
@@ -36,7 +36,9 @@ async def send_message(request: ChatRequest):
             task_type="chat",
             payload={
                 'message': request.message,
-                'history': [msg.model_dump() for msg in request.history],
+                # Already validated on ingress; the in-memory queue hands the
+                # ChatMessage objects straight to the worker
+                'history': request.history,
                 'conversation_id': request.conversation_id
             }
         )
@@ -4,15 +4,18 @@ Handles PDF upload, retrieval, and viewing.
 """
 
 import os
-from typing import List
 from fastapi import APIRouter, HTTPException, UploadFile, File
 from fastapi.responses import FileResponse, JSONResponse
 
-from app.models import PDFUploadResponse, PDFMetadata, PDFPageContent
+from app.models import PDFUploadResponse, PDFPageContent
+from app.responses import ORJSONResponse
 from app.services.pdf_service import get_pdf_service
 
 router = APIRouter(prefix="/pdf", tags=["pdf"])
 
+# PDFMetadata fields returned by the list endpoint (text content is omitted)
+LIST_FIELDS = ('pdf_id', 'filename', 'title', 'page_count', 'upload_date', 'file_size')
+
 
 @router.post("/upload", response_model=PDFUploadResponse)
 async def upload_pdf(file: UploadFile = File(...)):
@@ -55,25 +58,18 @@ async def upload_pdf(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
 
 
-@router.get("/list", response_model=List[PDFMetadata])
+@router.get("/list", response_class=ORJSONResponse)
 async def list_pdfs():
     """Get a list of all uploaded PDFs."""
     pdf_service = get_pdf_service()
     pdfs = pdf_service.get_all_pdfs()
     
-    # Return metadata without full text content
-    return [
-        PDFMetadata(
-            pdf_id=pdf.pdf_id,
-            filename=pdf.filename,
-            title=pdf.title,
-            page_count=pdf.page_count,
-            upload_date=pdf.upload_date,
-            file_size=pdf.file_size,
-            text_content={}  # Don't send full text in list
-        )
+    # Metadata comes from our own service, so skip response-model validation.
+    # Don't send full text in list.
+    return ORJSONResponse([
+        {**{field: getattr(pdf, field) for field in LIST_FIELDS}, 'text_content': {}}
         for pdf in pdfs
-    ]
+    ])
 
 
 @router.delete("/clear-all")
@@ -84,7 +80,7 @@ async def clear_all_pdfs():
     return {"status": "success", "message": "All PDFs cleared"}
 
 
-@router.get("/{pdf_id}", response_model=PDFMetadata)
+@router.get("/{pdf_id}", response_class=ORJSONResponse)
 async def get_pdf_metadata(pdf_id: str):
     """Get metadata for a specific PDF."""
     pdf_service = get_pdf_service()
@@ -93,7 +89,11 @@ async def get_pdf_metadata(pdf_id: str):
     if not metadata:
         raise HTTPException(status_code=404, detail="PDF not found")
     
-    return metadata
+    # Page text is loaded from disk on demand rather than cached with metadata
+    return ORJSONResponse({
+        **metadata.__dict__,
+        'text_content': await pdf_service.get_text_content(pdf_id)
+    })
 
 
 @router.get("/{pdf_id}/file")
@@ -101,7 +101,8 @@ async def get_pdf_file(pdf_id: str):
     """
     Get the actual PDF file for viewing.
     
-    Returns the PDF file with appropriate headers for browser viewing.
+    Returns the PDF file with appropriate headers for browser viewing,
+    including range request support.
     """
     pdf_service = get_pdf_service()
     file_path = pdf_service.get_pdf_path(pdf_id)
@@ -112,12 +113,18 @@ async def get_pdf_file(pdf_id: str):
     metadata = pdf_service.get_metadata(pdf_id)
     filename = metadata.filename if metadata else f"{pdf_id}.pdf"
     
+    # Passing stat_result lets the server use its sendfile path without a
+    # second stat. FileResponse advertises and serves byte ranges itself,
+    # for the browser viewer. PDF IDs are content hashes, so the file
+    # behind an ID never changes.
     return FileResponse(
         path=str(file_path),
         media_type="application/pdf",
         filename=filename,
+        stat_result=os.stat(file_path),
         headers={
-            "Content-Disposition": f"inline; filename={filename}"
+            "Content-Disposition": f"inline; filename={filename}",
+            "Cache-Control": "private, max-age=3600"
         }
     )
 
@@ -126,7 +133,7 @@ async def get_pdf_file(pdf_id: str):
 async def get_pdf_page(pdf_id: str, page_number: int):
     """Get the text content of a specific PDF page."""
     pdf_service = get_pdf_service()
-    page_content = pdf_service.get_page_content(pdf_id, page_number)
+    page_content = await pdf_service.get_page_content(pdf_id, page_number)
     
     if not page_content:
         raise HTTPException(
@@ -155,7 +162,7 @@ async def search_pdf(pdf_id: str, q: str, max_results: int = 10):
     if not pdf_service.get_metadata(pdf_id):
         raise HTTPException(status_code=404, detail="PDF not found")
     
-    results = pdf_service.search_in_pdf(pdf_id, q, max_results)
+    results = await pdf_service.search_in_pdf(pdf_id, q, max_results)
     
     return {
         "pdf_id": pdf_id,
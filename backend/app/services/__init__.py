@@ -1,7 +1,7 @@
 """Services package initialization."""
 
 from app.services.pdf_service import PDFService, get_pdf_service, init_pdf_service
-from app.services.ai_service import AIService, get_ai_service
+from app.services.ai_service import AIService, get_ai_service, close_ai_service
 from app.services.queue_service import QueueService, get_queue_service, init_queue_service
 
 __all__ = [
@@ -10,6 +10,7 @@ __all__ = [
     'init_pdf_service',
     'AIService',
     'get_ai_service',
+    'close_ai_service',
     'QueueService',
     'get_queue_service',
     'init_queue_service',
@@ -3,26 +3,172 @@ Handles AI response generation with streaming support.
 """
 
 import asyncio
-import json
+import io
+import logging
 import re
-from typing import AsyncGenerator, Dict, List, Optional, Any
-from groq import Groq
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncGenerator, Dict, List, Optional, Tuple, Any
+import httpx
+import orjson
+from groq import AsyncGroq
 
 from app.config import get_settings
 from app.models import (
     ChatMessage, 
-    Citation, 
-    SourceCard,
+    MessageRole,
     ToolCall, 
     ToolCallType,
-    UIComponent,
     UIComponentType,
     InfoCardData,
     DataTableData,
-    StreamEvent,
     StreamEventType,
 )
-from app.services.pdf_service import get_pdf_service, PDFService
+from app.services.pdf_service import get_pdf_service, tokenize, PDFService
+
+logger = logging.getLogger(__name__)
+
+
+# Connection pool for Groq API calls, kept alive across chat turns so
+# each turn reuses a warm TLS connection
+GROQ_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=300)
+GROQ_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Search result and context prompt cache bounds
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 60.0  # seconds
+CONTEXT_CACHE_SIZE = 256
+
+# Completed responses replayed for identical requests
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_TTL = 300.0  # seconds
+
+# Text streaming: flush buffered deltas after this many chunks or seconds
+SSE_COALESCE_MAX_CHUNKS = 8
+SSE_COALESCE_WINDOW = 0.01
+
+# Query keyword extraction. Tokens match pdf_service.tokenize; the regex
+# also drops tokens shorter than 3 characters.
+_KEYWORD_RE = re.compile(r"\w{3,}")
+_STOP_WORDS = frozenset({
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'any', 'can',
+    'had', 'her', 'was', 'one', 'our', 'out', 'has', 'have', 'his', 'how',
+    'its', 'may', 'who', 'did', 'get', 'him', 'she', 'too', 'use', 'that',
+    'this', 'with', 'from', 'they', 'them', 'then', 'than', 'what', 'when',
+    'where', 'which', 'while', 'will', 'would', 'could', 'should', 'there',
+    'their', 'these', 'those', 'about', 'into', 'were', 'been', 'being',
+    'does', 'some', 'such', 'also', 'just', 'more', 'most', 'very', 'your',
+    'tell', 'please', 'explain', 'describe', 'document', 'documents',
+})
+
+# Prompt text shared by every request. Identical prefixes also keep the
+# requests friendly to provider-side prompt caching.
+_SYSTEM_PROMPT = "You are a helpful AI assistant. Use inline citations like [1], [2] when referencing documents."
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+# Speaker labels for prior turns in the prompt; anything else is the assistant
+_ROLE_LABELS = {MessageRole.USER: "User"}
+
+_CONTEXT_HEADER = "Here are relevant document excerpts to reference in your answer:\n"
+
+_CONTEXT_INSTRUCTIONS = """
+Instructions:
+1. Use the document content above to answer the question
+2. Include inline citations like [1], [2] when referencing documents
+3. Be accurate and cite specific sections
+4. If the documents don't contain relevant information, say so
+"""
+
+# One retrieved excerpt in the context prompt: header, excerpt text, footer
+_CONTEXT_DOC_HEADER = """
+Document [{number}]: {title}
+Source: {filename} (Page {page})
+Content:
+"""
+_CONTEXT_DOC_FOOTER = "\n---\n"
+
+# Prompt budget for retrieved excerpts, leaving room for the history,
+# question and completion. Tokens are approximated as CHARS_PER_TOKEN
+# characters each; an excerpt with less than MIN_CONTEXT_CHARS of room
+# left is dropped.
+MAX_CONTEXT_TOKENS = 3500
+CHARS_PER_TOKEN = 4
+MIN_CONTEXT_CHARS = 200
+
+
+# Fixed framing around the content and timestamp of a partial text event
+_TEXT_EVENT_PREFIX = b'data: {"type":"%s","data":{"content":' % StreamEventType.TEXT.value.encode()
+_TEXT_EVENT_INFIX = b',"is_complete":false},"timestamp":"'
+_TEXT_EVENT_SUFFIX = b'"}\n\n'
+
+# Every event ends with its timestamp. Cached responses keep each event up
+# to the timestamp, and replays stamp them afresh and give citations and
+# source cards new ids.
+_TIMESTAMP_KEY = b'"timestamp":"'
+_EVENT_ID_RE = re.compile(rb'^(data: \{"type":"[a-z_]+","data":\{"id":")[0-9a-f-]{36}"')
+
+
+def _estimate_tokens(text: str) -> int:
+    """Cheap token count estimate, close enough for budgeting prompts."""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def _now_iso() -> str:
+    """Current UTC time as an ISO 8601 string."""
+    return datetime.utcnow().isoformat()
+
+
+def _strip_timestamp(event: bytes) -> bytes:
+    """Cut an SSE event off after its timestamp key, for caching."""
+    return event[:event.rindex(_TIMESTAMP_KEY) + len(_TIMESTAMP_KEY)]
+
+
+def _restamp(events: List[bytes]) -> List[bytes]:
+    """Complete cached events with the current time and fresh event ids."""
+    timestamp = _now_iso().encode()
+    replayed = []
+    for event in events:
+        match = _EVENT_ID_RE.match(event)
+        if match:
+            event = b"%s%s\"%s" % (match.group(1), str(uuid.uuid4()).encode(), event[match.end():])
+        replayed.append(event + timestamp + _TEXT_EVENT_SUFFIX)
+    return replayed
+
+
+class _SharedStream:
+    """Buffer of SSE chunks from one response, replayable by many readers."""
+    
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+    
+    def append(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self._notify()
+    
+    def close(self):
+        self.done = True
+        self._notify()
+    
+    def _notify(self):
+        # Wake current readers and arm a fresh event for the next update
+        self._updated.set()
+        self._updated = asyncio.Event()
+    
+    async def replay(self) -> AsyncGenerator[bytes, None]:
+        """Yield every chunk from the start, waiting for new ones until closed."""
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                return
+            await self._updated.wait()
 
 
 class AIService:
@@ -31,168 +177,395 @@ class AIService:
     def __init__(self):
         settings = get_settings()
         
-        # Initialize the Groq client
-        self.client = Groq(api_key=settings.groq_api_key)
+        # Initialize the async Groq client so streaming doesn't block the event
+        # loop, on a pooled HTTP client shared by every request
+        self._http_client = httpx.AsyncClient(limits=GROQ_HTTP_LIMITS, timeout=GROQ_HTTP_TIMEOUT)
+        self.client = AsyncGroq(api_key=settings.groq_api_key, http_client=self._http_client)
         
         # Use llama-3.3-70b-versatile for best quality
         self.model_name = "llama-3.3-70b-versatile"
         
         self._citation_counter = 0
+        
+        # LRU of recent search hits: key -> (expires_at, [(pdf_id, page)])
+        self._search_cache: "OrderedDict[tuple, Tuple[float, List[Tuple[str, int]]]]" = OrderedDict()
+        # LRU of built context prompts:
+        # (corpus_version, pages) -> (prompt, number of contexts included)
+        self._context_cache: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        
+        # Responses being generated, and an LRU of completed ones:
+        # key -> (expires_at, SSE events up to their timestamps)
+        self._inflight: Dict[tuple, _SharedStream] = {}
+        self._response_cache: "OrderedDict[tuple, Tuple[float, List[bytes]]]" = OrderedDict()
+    
+    async def warmup(self):
+        """Open a pooled connection to Groq ahead of the first chat turn."""
+        try:
+            await self.client.models.list()
+        except Exception as e:
+            logger.warning("Groq warmup failed: %s", e)
     
-    def _build_context_prompt(self, pdf_contexts: List[Dict[str, Any]]) -> str:
-        """Build context prompt from PDF contents."""
+    async def aclose(self):
+        """Stop responses still being generated, then close the pooled HTTP connections."""
+        tasks = [shared.task for shared in self._inflight.values() if shared.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.close()
+    
+    def _build_context_prompt(
+        self,
+        pdf_contexts: List[Dict[str, Any]]
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Build context prompt from PDF contents.
+        
+        Contexts arrive ranked by relevance and are added in that order
+        until MAX_CONTEXT_TOKENS is spent, so the lowest-ranked excerpts are
+        the ones trimmed or dropped.
+        
+        Returns:
+            The prompt, and the leading contexts that made it into the prompt
+        """
         if not pdf_contexts:
-            return ""
+            return "", []
         
-        context_parts = ["Here are relevant document excerpts to reference in your answer:\n"]
+        buf = io.StringIO()
+        buf.write(_CONTEXT_HEADER)
+        budget = MAX_CONTEXT_TOKENS - _estimate_tokens(_CONTEXT_HEADER) - _estimate_tokens(_CONTEXT_INSTRUCTIONS)
         
+        included = 0
         for i, ctx in enumerate(pdf_contexts, 1):
-            context_parts.append(f"""
-Document [{i}]: {ctx['title']}
-Source: {ctx['filename']} (Page {ctx['page']})
-Content:
-{ctx['text'][:2000]}
----
-""")
+            header = _CONTEXT_DOC_HEADER.format(
+                number=i,
+                title=ctx['title'],
+                filename=ctx['filename'],
+                page=ctx['page']
+            )
+            budget -= _estimate_tokens(header) + _estimate_tokens(_CONTEXT_DOC_FOOTER)
+            room = budget * CHARS_PER_TOKEN
+            if room < MIN_CONTEXT_CHARS:
+                break
+            
+            text = ctx['text']
+            if len(text) > room:
+                text = text[:room]
+            budget -= _estimate_tokens(text)
+            
+            buf.write("\n")
+            buf.write(header)
+            buf.write(text)
+            buf.write(_CONTEXT_DOC_FOOTER)
+            included = i
         
-        context_parts.append("""
-Instructions:
-1. Use the document content above to answer the question
-2. Include inline citations like [1], [2] when referencing documents
-3. Be accurate and cite specific sections
-4. If the documents don't contain relevant information, say so
-""")
+        buf.write("\n")
+        buf.write(_CONTEXT_INSTRUCTIONS)
         
-        return "\n".join(context_parts)
+        return buf.getvalue(), pdf_contexts[:included]
     
-    async def _search_documents(self, query: str, pdf_service: PDFService, pdf_ids: List[str] = None) -> List[Dict[str, Any]]:
-        """Search specified PDFs for relevant content."""
+    def _extract_keywords(self, text: str) -> List[str]:
+        """Extract up to 10 distinct search keywords, skipping stop words."""
+        keywords = dict.fromkeys(
+            word for word in _KEYWORD_RE.findall(text.lower()) if word not in _STOP_WORDS
+        )
+        return list(keywords)[:10]
+    
+    async def _load_contexts(
+        self,
+        hits: List[Tuple[str, int]],
+        pdf_service: PDFService
+    ) -> List[Dict[str, Any]]:
+        """Turn (pdf_id, page) search hits into excerpts with their page text."""
         results = []
-        query_lower = query.lower()
+        for pdf_id, page_num in hits:
+            pdf = pdf_service.get_metadata(pdf_id)
+            page_content = await pdf_service.get_page_content(pdf_id, page_num)
+            if pdf and page_content:
+                results.append({
+                    'pdf_id': pdf.pdf_id,
+                    'filename': pdf.filename,
+                    'title': pdf.title,
+                    'page': page_num,
+                    'text': page_content.text
+                })
+        return results
+    
+    async def _search_documents(
+        self,
+        query: str,
+        pdf_service: PDFService,
+        pdf_ids: List[str] = None,
+        max_results: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Search specified PDFs for relevant content."""
+        if pdf_ids:
+            pdf_ids = list(dict.fromkeys(pdf_ids))
+            terms: Tuple[str, ...] = ()
+        else:
+            # Fall back to every token for queries made only of short/stop words
+            terms = tuple(sorted(set(self._extract_keywords(query) or tokenize(query))))
+
+        # Follow-up questions often repeat the same search; the corpus version
+        # changes whenever PDFs are added or cleared, invalidating old entries.
+        # Only the (pdf_id, page) hits are cached; the page text itself stays
+        # under the PDF service's page cache bound.
+        cache_key = (pdf_service.corpus_version, tuple(pdf_ids or ()), terms, max_results)
+        now = time.monotonic()
+        cached = self._search_cache.get(cache_key)
+        if cached and cached[0] > now:
+            self._search_cache.move_to_end(cache_key)
+            return await self._load_contexts(cached[1], pdf_service)
+
+        hits: List[Tuple[str, int]] = []
 
-        # Get PDFs to search - either specified ones or all if none specified
-        pdfs_to_search = []
         if pdf_ids:
             # If specific PDFs are requested, include content from all their pages
             for pdf_id in pdf_ids:
+                remaining = max_results - len(hits)
+                if remaining <= 0:
+                    break
                 pdf = pdf_service.get_metadata(pdf_id)
                 if pdf:
-                    pdfs_to_search.append(pdf)
+                    hits.extend((pdf_id, page_num) for page_num in range(1, min(pdf.page_count, remaining) + 1))
         else:
-            pdfs_to_search = pdf_service.get_all_pdfs()
-
-        for pdf in pdfs_to_search:
-            # If specific PDFs were requested, include content from all pages
-            # Otherwise, only include pages that match the query
-            should_include_all_pages = pdf_ids is not None and pdf.pdf_id in pdf_ids
-
-            for page_num in range(1, pdf.page_count + 1):
-                page_content = pdf_service.get_page_content(pdf.pdf_id, page_num)
-                if page_content:
-                    if should_include_all_pages:
-                        # Include all pages from requested PDFs
-                        results.append({
-                            'pdf_id': pdf.pdf_id,
-                            'filename': pdf.filename,
-                            'title': pdf.title,
-                            'page': page_num,
-                            'text': page_content.text[:1500]
-                        })
-                    else:
-                        # Only include pages that match the query
-                        text_lower = page_content.text.lower()
-                        if query_lower in text_lower or any(word in text_lower for word in query_lower.split() if len(word) > 2):
-                            results.append({
-                                'pdf_id': pdf.pdf_id,
-                                'filename': pdf.filename,
-                                'title': pdf.title,
-                                'page': page_num,
-                                'text': page_content.text[:1500]
-                            })
-
-        # Sort by relevance (pages with more query matches first)
-        if not pdf_ids:
-            results.sort(key=lambda x: sum(1 for word in query_lower.split() if word in x['text'].lower()), reverse=True)
-
-        return results[:10]  # Allow more results
+            # Otherwise look up matching pages in the inverted index, ranked by
+            # how many distinct query words they contain
+            hits = pdf_service.search_pages(terms, max_pages=max_results)
+
+        self._search_cache[cache_key] = (now + SEARCH_CACHE_TTL, hits)
+        if len(self._search_cache) > SEARCH_CACHE_SIZE:
+            self._search_cache.popitem(last=False)
+
+        return await self._load_contexts(hits, pdf_service)
+    
+    def _response_key(
+        self,
+        message: str,
+        history: List[ChatMessage],
+        pdf_ids: Optional[List[str]]
+    ) -> tuple:
+        """Key identifying everything that shapes a response's prompt."""
+        try:
+            corpus_version = get_pdf_service().corpus_version
+        except RuntimeError:
+            corpus_version = None
+        
+        return (
+            message,
+            tuple((msg.role.value, msg.content) for msg in history[-3:]),
+            tuple(pdf_ids or ()),
+            corpus_version
+        )
     
     async def generate_streaming_response(
         self,
         message: str,
         history: List[ChatMessage],
         pdf_ids: List[str] = None
-    ) -> AsyncGenerator[str, None]:
-        """Generate AI response with streaming support."""
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Generate AI response with streaming support.
+        
+        Identical requests share a single Groq stream while it is in flight,
+        and recently completed responses are replayed from cache.
+        """
+        key = self._response_key(message, history, pdf_ids)
+        
+        cached = self._response_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._response_cache.move_to_end(key)
+            for chunk in _restamp(cached[1]):
+                yield chunk
+            return
+        
+        shared = self._inflight.get(key)
+        if shared is None:
+            # Produce in a background task so the stream survives the first
+            # client disconnecting while others are still reading it
+            shared = _SharedStream()
+            self._inflight[key] = shared
+            shared.task = asyncio.create_task(
+                self._produce(key, shared, self._stream_response(message, history, pdf_ids))
+            )
+        
+        async for chunk in shared.replay():
+            yield chunk
+    
+    async def _produce(
+        self,
+        key: tuple,
+        shared: "_SharedStream",
+        events: AsyncGenerator[bytes, None]
+    ):
+        """Run a response stream into a shared buffer, caching it on success."""
+        try:
+            async for chunk in events:
+                shared.append(chunk)
+        except Exception as e:
+            shared.append(self._format_sse(StreamEventType.ERROR, {
+                'error': str(e),
+                'message': 'Failed to generate response'
+            }))
+        else:
+            events = [_strip_timestamp(chunk) for chunk in shared.chunks]
+            self._response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, events)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        finally:
+            shared.close()
+            self._inflight.pop(key, None)
+    
+    async def _stream_response(
+        self,
+        message: str,
+        history: List[ChatMessage],
+        pdf_ids: List[str] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """Search documents, stream the Groq completion and send citations."""
         pdf_contexts = []
         citations = []
+        search_start = time.perf_counter()
 
         # Search PDFs if available
         try:
             pdf_service = get_pdf_service()
             if pdf_service.get_all_pdfs():
                 pdf_contexts = await self._search_documents(message, pdf_service, pdf_ids)
-                print(f"DEBUG: Found {len(pdf_contexts)} PDF contexts for query: {message}")
-
-                # Create citations for found content
-                for i, ctx in enumerate(pdf_contexts, 1):
-                    citations.append(Citation(
-                        number=i,
-                        pdf_id=ctx['pdf_id'],
-                        page_number=ctx['page'],
-                        text_snippet=ctx['text'][:200] + '...',
-                        highlight_start=0,
-                        highlight_end=min(200, len(ctx['text']))
-                    ))
+                logger.debug("Found %d PDF contexts for query: %s", len(pdf_contexts), message)
         except RuntimeError:
             pass  # No PDF service available
+        t_search_ms = (time.perf_counter() - search_start) * 1000
 
-        # Build prompt with context
-        context = self._build_context_prompt(pdf_contexts)
-        print(f"DEBUG: Context prompt:\n{context[:500]}...")
+        # Build prompt with context. The excerpts are fully determined by their
+        # (pdf_id, page) pairs within one corpus version, so reuse the text.
+        if pdf_contexts:
+            context_key = (
+                pdf_service.corpus_version,
+                tuple((ctx['pdf_id'], ctx['page']) for ctx in pdf_contexts)
+            )
+            cached = self._context_cache.get(context_key)
+            if cached is None:
+                context, included = self._build_context_prompt(pdf_contexts)
+                self._context_cache[context_key] = (context, len(included))
+                if len(self._context_cache) > CONTEXT_CACHE_SIZE:
+                    self._context_cache.popitem(last=False)
+            else:
+                context, count = cached
+                included = pdf_contexts[:count]
+                self._context_cache.move_to_end(context_key)
+            
+            # Only excerpts the model was shown can be cited or shown as sources
+            pdf_contexts = included
+        else:
+            context = ""
+        
+        # Create citations for the content in the prompt
+        for i, ctx in enumerate(pdf_contexts, 1):
+            # Plain dicts matching the Citation schema; these are our own
+            # values, so skip model validation and dumping per event
+            citations.append({
+                'id': str(uuid.uuid4()),
+                'number': i,
+                'pdf_id': ctx['pdf_id'],
+                'page_number': ctx['page'],
+                'text_snippet': ctx['text'][:200] + '...',
+                'highlight_start': 0,
+                'highlight_end': min(200, len(ctx['text'])),
+                'confidence': 0.9
+            })
+        logger.debug("Context prompt:\n%.500s...", context)
 
-        history_text = "\n".join([
-            f"{'User' if msg.role.value == 'user' else 'Assistant'}: {msg.content}"
-            for msg in history[-3:]
-        ])
+        history_text = "\n".join(
+            f"{_ROLE_LABELS.get(msg.role, 'Assistant')}: {msg.content}" for msg in history[-3:]
+        )
 
         prompt = f"{context}\n\nPrevious conversation:\n{history_text}\n\nQuestion: {message}"
-        print(f"DEBUG: Full prompt length: {len(prompt)}")
+        logger.debug("Full prompt length: %d", len(prompt))
+
+        # Stream response from Groq
+        llm_start = time.perf_counter()
+        first_token_at = None
+        response = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                _SYSTEM_MESSAGE,
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=2048,
+            stream=True
+        )
+
+        # Coalesce token deltas into one text event per short window to
+        # cut per-event encode and send overhead. The next delta is awaited
+        # as a task so a window that ends between deltas still flushes.
+        loop = asyncio.get_running_loop()
+        buffer: List[str] = []
+        flush_at = 0.0
+        deltas = response.__aiter__()
+        next_delta: Optional[asyncio.Future] = None
 
         try:
-            # Stream response from Groq
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful AI assistant. Use inline citations like [1], [2] when referencing documents."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2048,
-                stream=True
-            )
+            while True:
+                if next_delta is None:
+                    next_delta = asyncio.ensure_future(deltas.__anext__())
+                if buffer:
+                    done, _ = await asyncio.wait({next_delta}, timeout=max(0.0, flush_at - loop.time()))
+                    if not done:
+                        yield self._format_text_sse(''.join(buffer))
+                        buffer.clear()
+                        continue
 
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    yield self._format_sse(StreamEventType.TEXT, {
-                        'content': chunk.choices[0].delta.content,
-                        'is_complete': False
-                    })
+                try:
+                    chunk = await next_delta
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_delta = None
 
-            yield self._format_sse(StreamEventType.TEXT, {
-                'content': '',
-                'is_complete': True
-            })
+                content = chunk.choices[0].delta.content
+                if not content:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
 
-        except Exception as e:
-            yield self._format_sse(StreamEventType.ERROR, {
-                'error': str(e),
-                'message': 'Failed to generate response'
-            })
-            return
+                if not buffer:
+                    flush_at = loop.time() + SSE_COALESCE_WINDOW
+                buffer.append(content)
+                if len(buffer) >= SSE_COALESCE_MAX_CHUNKS:
+                    yield self._format_text_sse(''.join(buffer))
+                    buffer.clear()
+        except Exception:
+            # Send the text already generated before the stream error
+            if buffer:
+                yield self._format_text_sse(''.join(buffer))
+                buffer.clear()
+            raise
+        finally:
+            if next_delta is not None:
+                next_delta.cancel()
+
+        if buffer:
+            yield self._format_text_sse(''.join(buffer))
+
+        llm_end = time.perf_counter()
+        logger.info(
+            "Response timings: t_search_ms=%.1f t_first_token_ms=%.1f t_llm_ms=%.1f",
+            t_search_ms,
+            ((first_token_at or llm_end) - llm_start) * 1000,
+            (llm_end - llm_start) * 1000
+        )
+
+        yield self._format_sse(StreamEventType.TEXT, {
+            'content': '',
+            'is_complete': True
+        })
 
-        # Send citations and source cards
+        # Send citations and source cards. They are emitted back-to-back, so
+        # they share one timestamp.
+        timestamp = _now_iso()
         for citation in citations:
-            yield self._format_sse(StreamEventType.CITATION, citation.model_dump())
+            yield self._format_sse(StreamEventType.CITATION, citation, timestamp)
 
         # Send source cards for unique PDFs
         seen_pdfs = set()
@@ -201,27 +574,44 @@ Instructions:
                 seen_pdfs.add(ctx['pdf_id'])
                 pages = [c['page'] for c in pdf_contexts if c['pdf_id'] == ctx['pdf_id']]
 
-                source_card = SourceCard(
-                    pdf_id=ctx['pdf_id'],
-                    filename=ctx['filename'],
-                    title=ctx['title'],
-                    page_count=pdf_service.get_metadata(ctx['pdf_id']).page_count,
-                    relevant_pages=pages,
-                    snippet=ctx['text'][:150] + '...'
-                )
+                # Plain dict matching the UIComponent/SourceCard schema
+                ui_component = {
+                    'id': str(uuid.uuid4()),
+                    'type': UIComponentType.SOURCE_CARD.value,
+                    'data': {
+                        'pdf_id': ctx['pdf_id'],
+                        'filename': ctx['filename'],
+                        'title': ctx['title'],
+                        'page_count': pdf_service.get_metadata(ctx['pdf_id']).page_count,
+                        'relevant_pages': pages,
+                        'snippet': ctx['text'][:150] + '...'
+                    }
+                }
+                yield self._format_sse(StreamEventType.UI_COMPONENT, ui_component, timestamp)
 
-                ui_component = UIComponent(
-                    type=UIComponentType.SOURCE_CARD,
-                    data=source_card
-                )
-                yield self._format_sse(StreamEventType.UI_COMPONENT, ui_component.model_dump())
-
-        yield self._format_sse(StreamEventType.DONE, {'message': 'Complete'})
+        yield self._format_sse(StreamEventType.DONE, {'message': 'Complete'}, timestamp)
+    
+    def _format_sse(
+        self,
+        event_type: StreamEventType,
+        data: Dict[str, Any],
+        timestamp: Optional[str] = None
+    ) -> bytes:
+        """Format data as Server-Sent Event, optionally reusing a batch timestamp."""
+        payload = {'type': event_type.value, 'data': data, 'timestamp': timestamp or _now_iso()}
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
     
-    def _format_sse(self, event_type: StreamEventType, data: Dict[str, Any]) -> str:
-        """Format data as Server-Sent Event."""
-        event = StreamEvent(type=event_type, data=data)
-        return f"data: {json.dumps(event.model_dump(), default=str)}\n\n"
+    def _format_text_sse(self, content: str) -> bytes:
+        """
+        Format a partial text event, the per-token hot path.
+        
+        Produces the same bytes as _format_sse(StreamEventType.TEXT, ...) but
+        only serializes the content string itself.
+        """
+        return b"".join((
+            _TEXT_EVENT_PREFIX, orjson.dumps(content),
+            _TEXT_EVENT_INFIX, _now_iso().encode(), _TEXT_EVENT_SUFFIX
+        ))
 
 
 # Global AI service instance
@@ -234,3 +624,11 @@ def get_ai_service() -> AIService:
     if ai_service is None:
         ai_service = AIService()
     return ai_service
+
+
+async def close_ai_service():
+    """Close the global AI service, so the next get_ai_service() starts afresh."""
+    global ai_service
+    if ai_service is not None:
+        service, ai_service = ai_service, None
+        await service.aclose()
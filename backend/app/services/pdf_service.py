@@ -3,27 +3,136 @@ PDF processing service.
 Handles PDF upload, text extraction, and page-level indexing.
 """
 
+import asyncio
+import gzip
 import os
+import re
 import hashlib
+import tempfile
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import logging
 import pdfplumber
+import pypdfium2 as pdfium
 from PyPDF2 import PdfReader
-import aiofiles
 import aiofiles.os
+import orjson
 
 from app.models import PDFMetadata, PDFPageContent, PDFHighlight
 
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Extracted page text is stored next to each PDF as <pdf_id>.pages.json.gz
+PAGES_SUFFIX = ".pages.json.gz"
+
+# Number of PDFs whose page text is kept in memory at once
+PAGE_CACHE_SIZE = 32
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _content_id(content: bytes) -> str:
+    """
+    Derive a PDF ID from its content.
+    
+    BLAKE2b is faster than MD5 on 64-bit CPUs; an 8-byte digest keeps the
+    16 hex character IDs. This is a dedup key, not a security boundary.
+    """
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+
+def _legacy_content_id(content: bytes) -> str:
+    """PDF ID derived from content by earlier versions, which stored files under it."""
+    return hashlib.md5(content).hexdigest()[:16]
+
+
+def _replace_file(path: Path, data: bytes):
+    """
+    Write data to a uniquely named temp file beside path, then rename it
+    into place, so readers never see a partially written file.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _count_pages(file_path: str) -> int:
+    """Read a PDF's page count without extracting any text."""
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> Dict[int, str]:
+    """
+    Extract text for the 0-indexed page range [start, stop) of a PDF.
+    
+    Runs in a worker process. Uses pypdfium2 (native PDFium) for speed,
+    falling back to pdfplumber, which copes better with some edge cases.
+    
+    Returns:
+        Mapping of 1-indexed page number -> text
+    """
+    try:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            text_content = {}
+            for i in range(start, stop):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                # PDFium separates lines with CRLF; match pdfplumber's output
+                text_content[i + 1] = textpage.get_text_range().replace("\r\n", "\n")
+                textpage.close()
+                page.close()
+            return text_content
+        finally:
+            pdf.close()
+    
+    except Exception:
+        # Fallback to pdfplumber if PDFium fails, only loading the requested pages
+        with pdfplumber.open(file_path, pages=list(range(start + 1, stop + 1))) as pdf:
+            return {page.page_number: page.extract_text() or "" for page in pdf.pages}
+
 
 class PDFService:
     """Service for processing and managing PDF documents."""
     
-    def __init__(self, storage_path: str):
+    def __init__(self, storage_path: str, executor: ProcessPoolExecutor, max_workers: int):
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
+        # Text extraction runs on the app's CPU pool, whose lifetime the
+        # app manages; each PDF is split into one page range per pool worker
+        self._executor = executor
+        self._max_workers = max(1, max_workers)
         self._metadata_cache: Dict[str, PDFMetadata] = {}
-        self._page_content_cache: Dict[str, Dict[int, str]] = {}
+        # Uploads still being stored and extracted, so identical concurrent
+        # uploads share one ingestion
+        self._ingesting: Dict[str, "asyncio.Task[PDFMetadata]"] = {}
+        # Page text lives in a sidecar file per PDF; an LRU keeps only the
+        # most recently used PDFs' (page texts, lowercased page texts)
+        self._page_cache: "OrderedDict[str, Tuple[List[str], List[str]]]" = OrderedDict()
+        # Built once at ingestion: pdf_id -> token -> page numbers, and
+        # pdf_id -> token counts per page (indexed by page - 1) for scoring
+        self._inverted_index: Dict[str, Dict[str, Set[int]]] = {}
+        self._page_term_freq: Dict[str, List[Counter]] = {}
+        # Bumped whenever the set of PDFs changes, for cache invalidation
+        self.corpus_version = 0
     
     async def save_pdf(self, content: bytes, filename: str) -> PDFMetadata:
         """
@@ -36,22 +145,163 @@ class PDFService:
         Returns:
             PDFMetadata with extracted information
         """
-        # Generate unique PDF ID based on content hash
-        pdf_id = hashlib.md5(content).hexdigest()[:16]
+        # Generate unique PDF ID based on content hash. hashlib releases the
+        # GIL while hashing large buffers, so hash off the event loop.
+        pdf_id = await asyncio.to_thread(_content_id, content)
+        
+        # The same content was already ingested. PDFs stored before the
+        # switch to BLAKE2b are still kept under their MD5-derived ID, and
+        # that is only worth hashing for when about to store a new copy.
+        cached = self._metadata_cache.get(pdf_id)
+        if cached is None and self._metadata_cache:
+            legacy_id = await asyncio.to_thread(_legacy_content_id, content)
+            cached = self._metadata_cache.get(legacy_id)
+        if cached is not None:
+            return cached
+        
+        task = self._ingesting.get(pdf_id)
+        if task is None:
+            task = asyncio.create_task(self._ingest(pdf_id, content, filename))
+            self._ingesting[pdf_id] = task
+            task.add_done_callback(lambda _: self._ingesting.pop(pdf_id, None))
         
+        # Shielded so one cancelled upload doesn't abort the others sharing it
+        return await asyncio.shield(task)
+    
+    async def _ingest(self, pdf_id: str, content: bytes, filename: str) -> PDFMetadata:
+        """Store a new PDF, extract its text and cache it."""
         # Save file to storage
         file_path = self.storage_path / f"{pdf_id}.pdf"
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(content)
+        await asyncio.to_thread(_replace_file, file_path, content)
         
         # Extract text and metadata
         metadata = await self._process_pdf(pdf_id, file_path, filename, len(content))
         
-        # Cache the metadata
-        self._metadata_cache[pdf_id] = metadata
-        self._page_content_cache[pdf_id] = metadata.text_content
+        # Cache the metadata and index its pages
+        self._cache_pdf(metadata)
         
-        return metadata
+        return self._metadata_cache[pdf_id]
+    
+    def _cache_pdf(self, metadata: PDFMetadata):
+        """
+        Cache a processed PDF's metadata and build its inverted index.
+        
+        The page text itself is not kept; it is read back from the sidecar
+        written by _process_pdf when needed.
+        """
+        pdf_id = metadata.pdf_id
+        
+        self._metadata_cache[pdf_id] = metadata.model_copy(update={'text_content': {}})
+        
+        texts_lower = [metadata.text_content[page_num].lower() for page_num in sorted(metadata.text_content)]
+        index: Dict[str, Set[int]] = {}
+        term_freq: List[Counter] = []
+        for page_num, text_lower in enumerate(texts_lower, 1):
+            counts = Counter(_TOKEN_RE.findall(text_lower))
+            term_freq.append(counts)
+            for token in counts:
+                index.setdefault(token, set()).add(page_num)
+        
+        self._inverted_index[pdf_id] = index
+        self._page_term_freq[pdf_id] = term_freq
+        self._page_cache.pop(pdf_id, None)
+        self.corpus_version += 1
+    
+    def _pages_path(self, pdf_id: str) -> Path:
+        """Path of the sidecar file holding a PDF's extracted page text."""
+        return self.storage_path / f"{pdf_id}{PAGES_SUFFIX}"
+    
+    def _write_pages(self, pdf_id: str, metadata: PDFMetadata):
+        """Persist a PDF's extracted page text as compressed JSON."""
+        payload = {
+            'filename': metadata.filename,
+            'title': metadata.title,
+            'pages': [metadata.text_content[page_num] for page_num in sorted(metadata.text_content)]
+        }
+        # Workers starting against the same storage never read a partial
+        # sidecar and can share whichever one lands first
+        _replace_file(self._pages_path(pdf_id), gzip.compress(orjson.dumps(payload), compresslevel=6))
+    
+    def _read_sidecar(self, pdf_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read a PDF's sidecar payload, or None if it hasn't been written.
+        
+        A truncated or corrupt sidecar is deleted and also reported as
+        missing, so callers fall back to extracting the PDF again.
+        """
+        path = self._pages_path(pdf_id)
+        try:
+            payload = orjson.loads(gzip.decompress(path.read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, zlib.error, ValueError) as e:
+            payload = None
+            logger.warning("Discarding unreadable page text for PDF %s: %s", pdf_id, e)
+        
+        if not (
+            isinstance(payload, dict)
+            and isinstance(payload.get('filename'), str)
+            and isinstance(payload.get('title'), str)
+            and isinstance(payload.get('pages'), list)
+        ):
+            if payload is not None:
+                logger.warning("Discarding malformed page text for PDF %s", pdf_id)
+            path.unlink(missing_ok=True)
+            return None
+        return payload
+    
+    def _read_pages(self, pdf_id: str) -> Optional[Tuple[List[str], List[str]]]:
+        """Read a PDF's page texts and their lowercased copies from its sidecar."""
+        payload = self._read_sidecar(pdf_id)
+        if payload is None:
+            return None
+        
+        texts = payload['pages']
+        return texts, [text.lower() for text in texts]
+    
+    async def _get_pages(self, pdf_id: str) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Get the (page texts, lowercased page texts) of a known PDF.
+        
+        Cache misses read and decompress the sidecar in a thread, off the
+        event loop.
+        """
+        if pdf_id not in self._metadata_cache:
+            return None
+        
+        pages = self._page_cache.get(pdf_id)
+        if pages is not None:
+            self._page_cache.move_to_end(pdf_id)
+            return pages
+        
+        pages = await asyncio.to_thread(self._read_pages, pdf_id)
+        if pages is None:
+            # The sidecar is gone or was corrupt; extract the PDF again
+            pages = await self._rebuild_pages(pdf_id)
+        # Don't cache text for a PDF cleared while it was being read
+        if pages is not None and pdf_id in self._metadata_cache:
+            self._page_cache[pdf_id] = pages
+            if len(self._page_cache) > PAGE_CACHE_SIZE:
+                self._page_cache.popitem(last=False)
+        return pages
+    
+    async def _rebuild_pages(self, pdf_id: str) -> Optional[Tuple[List[str], List[str]]]:
+        """Re-extract a cached PDF's page text, rewriting its sidecar."""
+        metadata = self._metadata_cache.get(pdf_id)
+        file_path = self.get_pdf_path(pdf_id)
+        if metadata is None or file_path is None:
+            return None
+        
+        extracted = await self._process_pdf(pdf_id, file_path, metadata.filename, metadata.file_size)
+        texts = [extracted.text_content[page_num] for page_num in sorted(extracted.text_content)]
+        return texts, [text.lower() for text in texts]
+    
+    async def get_text_content(self, pdf_id: str) -> Dict[int, str]:
+        """Get the full page_num -> text mapping for a PDF."""
+        pages = await self._get_pages(pdf_id)
+        if pages is None:
+            return {}
+        return {page_num: text for page_num, text in enumerate(pages[0], 1)}
     
     async def _process_pdf(
         self, 
@@ -63,34 +313,36 @@ class PDFService:
         """
         Process a PDF file and extract text content per page.
         
-        Uses pdfplumber for better text extraction quality.
+        Extraction is CPU-bound, so page ranges are extracted in parallel
+        across the service's process pool, keeping the event loop free.
         """
-        text_content: Dict[int, str] = {}
         title = filename.replace('.pdf', '').replace('_', ' ').title()
         
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                page_count = len(pdf.pages)
-                
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text() or ""
-                    text_content[i + 1] = page_text  # 1-indexed pages
-                    
-                    # Try to extract title from first page if not set
-                    if i == 0 and page_text:
-                        first_line = page_text.split('\n')[0].strip()
-                        if first_line and len(first_line) < 100:
-                            title = first_line
-        
-        except Exception as e:
-            # Fallback to PyPDF2 if pdfplumber fails
-            reader = PdfReader(str(file_path))
-            page_count = len(reader.pages)
-            
-            for i, page in enumerate(reader.pages):
-                text_content[i + 1] = page.extract_text() or ""
+        loop = asyncio.get_running_loop()
+        path = str(file_path)
+        page_count = await loop.run_in_executor(self._executor, _count_pages, path)
+        
+        # Split the pages into one contiguous range per worker
+        chunk_size = max(1, -(-page_count // self._max_workers))
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(
+                self._executor, _extract_pages, path, start, min(start + chunk_size, page_count)
+            )
+            for start in range(0, page_count, chunk_size)
+        ])
+        
+        text_content: Dict[int, str] = {}
+        for chunk in chunks:
+            text_content.update(chunk)
         
-        return PDFMetadata(
+        # Try to extract title from first page
+        first_page = text_content.get(1)
+        if first_page:
+            first_line = first_page.split('\n')[0].strip()
+            if first_line and len(first_line) < 100:
+                title = first_line
+        
+        metadata = PDFMetadata(
             pdf_id=pdf_id,
             filename=filename,
             title=title,
@@ -99,27 +351,33 @@ class PDFService:
             text_content=text_content,
             upload_date=datetime.utcnow()
         )
+        
+        # Persist the extracted text so it doesn't have to stay in memory
+        await asyncio.to_thread(self._write_pages, pdf_id, metadata)
+        
+        return metadata
     
     def get_metadata(self, pdf_id: str) -> Optional[PDFMetadata]:
         """Get cached metadata for a PDF."""
         return self._metadata_cache.get(pdf_id)
     
-    def get_page_content(self, pdf_id: str, page_number: int) -> Optional[PDFPageContent]:
+    async def get_page_content(self, pdf_id: str, page_number: int) -> Optional[PDFPageContent]:
         """Get the text content of a specific page."""
-        if pdf_id not in self._page_content_cache:
+        pages = await self._get_pages(pdf_id)
+        if pages is None:
             return None
         
-        page_texts = self._page_content_cache[pdf_id]
-        if page_number not in page_texts:
+        page_texts = pages[0]
+        if not 1 <= page_number <= len(page_texts):
             return None
         
         return PDFPageContent(
             pdf_id=pdf_id,
             page_number=page_number,
-            text=page_texts[page_number]
+            text=page_texts[page_number - 1]
         )
     
-    def search_in_pdf(
+    async def search_in_pdf(
         self, 
         pdf_id: str, 
         query: str,
@@ -131,14 +389,15 @@ class PDFService:
         Returns:
             List of tuples: (page_number, snippet, start_pos, end_pos)
         """
-        if pdf_id not in self._page_content_cache:
+        pages = await self._get_pages(pdf_id)
+        if pages is None:
             return []
         
         results = []
         query_lower = query.lower()
+        texts, texts_lower = pages
         
-        for page_num, text in self._page_content_cache[pdf_id].items():
-            text_lower = text.lower()
+        for page_num, (text, text_lower) in enumerate(zip(texts, texts_lower), 1):
             start = 0
             
             while True:
@@ -175,25 +434,47 @@ class PDFService:
         
         Returns list of page numbers sorted by relevance.
         """
-        if pdf_id not in self._page_content_cache:
+        index = self._inverted_index.get(pdf_id)
+        if index is None:
             return []
         
-        page_scores: Dict[int, int] = {}
+        terms = [token for keyword in keywords for token in tokenize(keyword)]
         
-        for page_num, text in self._page_content_cache[pdf_id].items():
-            text_lower = text.lower()
-            score = 0
-            
-            for keyword in keywords:
-                score += text_lower.count(keyword.lower())
-            
-            if score > 0:
-                page_scores[page_num] = score
+        # Only pages in the terms' posting lists can score above zero
+        candidates: Set[int] = set()
+        for term in terms:
+            candidates.update(index.get(term, ()))
+        
+        term_freq = self._page_term_freq[pdf_id]
+        page_scores = {
+            page_num: sum(term_freq[page_num - 1][term] for term in terms)
+            for page_num in candidates
+        }
         
         # Sort by score descending
         sorted_pages = sorted(page_scores.items(), key=lambda x: x[1], reverse=True)
         return [page for page, _ in sorted_pages[:max_pages]]
     
+    def search_pages(
+        self,
+        terms: Iterable[str],
+        max_pages: int = 10
+    ) -> List[Tuple[str, int]]:
+        """
+        Find pages containing the given lowercase terms using the inverted index.
+        
+        Returns list of (pdf_id, page_number) sorted by the number of
+        distinct terms each page contains.
+        """
+        terms = set(terms)
+        page_hits: Counter = Counter()
+        for pdf_id, index in self._inverted_index.items():
+            for term in terms:
+                for page_num in index.get(term, ()):
+                    page_hits[(pdf_id, page_num)] += 1
+        
+        return [page for page, _ in page_hits.most_common(max_pages)]
+    
     def get_pdf_path(self, pdf_id: str) -> Optional[Path]:
         """Get the file path for a PDF."""
         file_path = self.storage_path / f"{pdf_id}.pdf"
@@ -207,49 +488,63 @@ class PDFService:
     
     async def clear_all(self):
         """Clear all PDFs from storage and cache."""
-        # Delete all PDF files
-        for file_path in self.storage_path.glob("*.pdf"):
+        # Delete all PDF files and their page text sidecars
+        paths = [*self.storage_path.glob("*.pdf"), *self.storage_path.glob(f"*{PAGES_SUFFIX}")]
+        for file_path in paths:
             try:
                 await aiofiles.os.remove(file_path)
             except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
+                logger.error("Error deleting %s: %s", file_path, e)
         
         # Clear caches
         self._metadata_cache.clear()
-        self._page_content_cache.clear()
+        self._page_cache.clear()
+        self._inverted_index.clear()
+        self._page_term_freq.clear()
+        self.corpus_version += 1
     
     async def load_existing_pdfs(self):
         """Load metadata for PDFs already in storage."""
-        print(f"Loading existing PDFs from {self.storage_path}")
+        logger.info("Loading existing PDFs from %s", self.storage_path)
         if not self.storage_path.exists():
-            print(f"Storage path {self.storage_path} does not exist")
+            logger.warning("Storage path %s does not exist", self.storage_path)
             return
 
         pdf_files = list(self.storage_path.glob("*.pdf"))
-        print(f"Found {len(pdf_files)} PDF files: {[f.name for f in pdf_files]}")
+        logger.info("Found %d PDF files: %s", len(pdf_files), [f.name for f in pdf_files])
 
-        for file_path in pdf_files:
-            pdf_id = file_path.stem
-            print(f"Processing PDF {pdf_id} from {file_path}")
-            if pdf_id not in self._metadata_cache:
-                try:
-                    async with aiofiles.open(file_path, 'rb') as f:
-                        content = await f.read()
+        pending = [f for f in pdf_files if f.stem not in self._metadata_cache]
+        await asyncio.gather(*[self._load_one(f) for f in pending], return_exceptions=True)
+
+    async def _load_one(self, file_path: Path):
+        """Load a single stored PDF, reusing its page text sidecar if present."""
+        pdf_id = file_path.stem
+        logger.info("Processing PDF %s from %s", pdf_id, file_path)
+        try:
+            stat = await aiofiles.os.stat(file_path)
 
-                    print(f"Read {len(content)} bytes for PDF {pdf_id}")
-                    metadata = await self._process_pdf(
-                        pdf_id,
-                        file_path,
-                        file_path.name,
-                        len(content)
-                    )
-                    self._metadata_cache[pdf_id] = metadata
-                    self._page_content_cache[pdf_id] = metadata.text_content
-                    print(f"Successfully loaded PDF {pdf_id}: {metadata.filename}")
-                except Exception as e:
-                    print(f"Error loading PDF {pdf_id}: {e}")
-                    import traceback
-                    traceback.print_exc()
+            pages = await asyncio.to_thread(self._read_sidecar, pdf_id)
+            if pages is not None:
+                metadata = PDFMetadata(
+                    pdf_id=pdf_id,
+                    filename=pages['filename'],
+                    title=pages['title'],
+                    page_count=len(pages['pages']),
+                    file_size=stat.st_size,
+                    text_content={page_num: text for page_num, text in enumerate(pages['pages'], 1)},
+                    upload_date=datetime.utcnow()
+                )
+            else:
+                metadata = await self._process_pdf(
+                    pdf_id,
+                    file_path,
+                    file_path.name,
+                    stat.st_size
+                )
+            self._cache_pdf(metadata)
+            logger.info("Successfully loaded PDF %s: %s", pdf_id, metadata.filename)
+        except Exception:
+            logger.exception("Error loading PDF %s", pdf_id)
 
 
 # Global PDF service instance (initialized in main.py)
@@ -264,8 +559,8 @@ def get_pdf_service() -> PDFService:
     return pdf_service
 
 
-def init_pdf_service(storage_path: str) -> PDFService:
-    """Initialize the global PDF service."""
+def init_pdf_service(storage_path: str, executor: ProcessPoolExecutor, max_workers: int) -> PDFService:
+    """Initialize the global PDF service on the app's CPU pool of max_workers processes."""
     global pdf_service
-    pdf_service = PDFService(storage_path)
+    pdf_service = PDFService(storage_path, executor, max_workers)
     return pdf_service
@@ -8,11 +8,42 @@ import uuid
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, Optional, Callable, Awaitable
+from typing import Any, Dict, List, Optional, Set, Callable, Awaitable
 import logging
 
+import orjson
+from pydantic import TypeAdapter
+
+from app.models import ChatMessage
+
 logger = logging.getLogger(__name__)
 
+# Result chunks buffered per job before the worker waits on its reader
+RESULT_BUFFER_SIZE = 1024
+
+# Seconds a worker waits for a full result buffer to gain room, and that a
+# job's results wait for a reader to connect, before the job is dropped
+RESULT_PUT_TIMEOUT = 30.0
+RESULT_READER_TIMEOUT = 60.0
+
+# Seconds shutdown waits for queued jobs to finish before cancelling workers
+SHUTDOWN_DRAIN_TIMEOUT = 10.0
+
+# Validates a whole chat history in one call; ChatMessage instances pass through
+_HISTORY_ADAPTER = TypeAdapter(List[ChatMessage])
+
+_JOB_NOT_FOUND_EVENT = b'data: {"type":"error","data":{"error":"Job not found"}}\n\n'
+
+
+def _error_event(error: str) -> bytes:
+    """Format a job failure as an SSE error event."""
+    payload = {
+        'type': 'error',
+        'data': {'error': error, 'message': 'Failed to process job'},
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
 
 class JobStatus(str, Enum):
     """Status of a queued job."""
@@ -49,6 +80,80 @@ class Job:
         }
 
 
+class ResultBuffer:
+    """
+    Bounded ring buffer carrying one job's result chunks to its reader.
+    
+    Producers wait for space when the buffer is full, so a slow client
+    applies backpressure instead of growing memory. A producer that waits
+    longer than put_timeout closes the buffer instead, so a reader that
+    stalls can't wedge its worker. The reader takes everything buffered
+    per wakeup, letting chunks be sent in batches.
+    """
+    
+    def __init__(self, capacity: int = RESULT_BUFFER_SIZE, put_timeout: float = RESULT_PUT_TIMEOUT):
+        self._items: List[Any] = [None] * capacity
+        self._capacity = capacity
+        self._put_timeout = put_timeout
+        self._head = 0
+        self._size = 0
+        self._closed = False
+        self._cond = asyncio.Condition()
+        self.has_reader = False
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed
+    
+    async def put(self, item: Any) -> bool:
+        """
+        Append an item, waiting for space.
+        
+        Returns False if the item was dropped because the buffer is closed,
+        either by its reader or by timing out while full.
+        """
+        async with self._cond:
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._closed or self._size < self._capacity),
+                    self._put_timeout
+                )
+            except asyncio.TimeoutError:
+                self._closed = True
+                self._cond.notify_all()
+            if self._closed:
+                return False
+            self._items[(self._head + self._size) % self._capacity] = item
+            self._size += 1
+            self._cond.notify_all()
+            return True
+    
+    async def drain(self) -> List[Any]:
+        """
+        Wait for at least one item, then remove and return all buffered items.
+        
+        Once the buffer is closed, the batch ends with the None end signal.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._closed or self._size > 0)
+            batch = []
+            for _ in range(self._size):
+                batch.append(self._items[self._head])
+                self._items[self._head] = None
+                self._head = (self._head + 1) % self._capacity
+            self._size = 0
+            if self._closed and (not batch or batch[-1] is not None):
+                batch.append(None)
+            self._cond.notify_all()
+            return batch
+    
+    async def close(self):
+        """Mark the reader as gone, releasing any waiting producer."""
+        async with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
 class QueueService:
     """
     In-memory async queue service for managing chat generation jobs.
@@ -59,11 +164,14 @@ class QueueService:
     - Streaming result retrieval via SSE
     """
     
-    def __init__(self, max_workers: int = 3):
+    def __init__(self, max_workers: int = 3, queue_maxsize: int = 0):
         self.max_workers = max_workers
-        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        # When bounded, enqueue waits for room, pushing back on producers
+        self._queue: asyncio.Queue[Job] = asyncio.Queue(maxsize=queue_maxsize)
         self._jobs: Dict[str, Job] = {}
-        self._result_queues: Dict[str, asyncio.Queue] = {}
+        self._result_queues: Dict[str, ResultBuffer] = {}
+        self._workers: List[asyncio.Task] = []
+        self._reapers: Set[asyncio.Task] = set()
         self._workers_started = False
         self._shutdown = False
     
@@ -74,13 +182,13 @@ class QueueService:
         
         self._workers_started = True
         for i in range(self.max_workers):
-            asyncio.create_task(self._worker(f"worker-{i}"))
+            self._workers.append(asyncio.create_task(self._worker(f"worker-{i}")))
         
-        logger.info(f"Started {self.max_workers} queue workers")
+        logger.info("Started %d queue workers", self.max_workers)
     
     async def _worker(self, worker_id: str):
         """Background worker that processes jobs from the queue."""
-        logger.info(f"{worker_id} started")
+        logger.info("%s started", worker_id)
         
         while not self._shutdown:
             try:
@@ -90,7 +198,7 @@ class QueueService:
                 except asyncio.TimeoutError:
                     continue
                 
-                logger.info(f"{worker_id} processing job {job.id}")
+                logger.info("%s processing job %s", worker_id, job.id)
                 
                 job.status = JobStatus.PROCESSING
                 job.started_at = datetime.utcnow()
@@ -98,23 +206,24 @@ class QueueService:
                 try:
                     # Process the job based on task type
                     if job.task_type == "chat":
-                        await self._process_chat_job(job)
+                        completed = await self._process_chat_job(job)
                     else:
                         raise ValueError(f"Unknown task type: {job.task_type}")
                     
-                    job.status = JobStatus.COMPLETED
+                    if completed:
+                        job.status = JobStatus.COMPLETED
+                    else:
+                        logger.warning("%s dropped job %s: no reader for its results", worker_id, job.id)
+                        job.status = JobStatus.CANCELLED
                     
                 except Exception as e:
-                    logger.error(f"{worker_id} job {job.id} failed: {e}")
+                    logger.error("%s job %s failed: %s", worker_id, job.id, e)
                     job.status = JobStatus.FAILED
                     job.error = str(e)
                     
                     # Send error to result queue
                     if job.id in self._result_queues:
-                        await self._result_queues[job.id].put({
-                            'type': 'error',
-                            'error': str(e)
-                        })
+                        await self._result_queues[job.id].put(_error_event(str(e)))
                 
                 finally:
                     job.completed_at = datetime.utcnow()
@@ -125,28 +234,36 @@ class QueueService:
                         await self._result_queues[job.id].put(None)  # Signal end
             
             except Exception as e:
-                logger.error(f"{worker_id} unexpected error: {e}")
+                logger.error("%s unexpected error: %s", worker_id, e)
     
-    async def _process_chat_job(self, job: Job):
-        """Process a chat generation job."""
+    async def _process_chat_job(self, job: Job) -> bool:
+        """
+        Process a chat generation job.
+        
+        Returns False if the job was abandoned because its result buffer
+        was closed before the response finished.
+        """
         from app.services.ai_service import get_ai_service
-        from app.models import ChatMessage
         
         ai_service = get_ai_service()
         
         message = job.payload.get('message', '')
         history_data = job.payload.get('history', [])
         
-        # Convert history dict to ChatMessage objects
-        history = [ChatMessage(**msg) if isinstance(msg, dict) else msg for msg in history_data]
+        # Convert history dicts to ChatMessage objects
+        history = _HISTORY_ADAPTER.validate_python(history_data)
         
         # Get result queue for this job
         result_queue = self._result_queues.get(job.id)
         
+        if result_queue is None or result_queue.closed:
+            return False
+        
         # Stream results to the queue
         async for chunk in ai_service.generate_streaming_response(message, history):
-            if result_queue:
-                await result_queue.put(chunk)
+            if not await result_queue.put(chunk):
+                return False
+        return True
     
     async def enqueue(
         self, 
@@ -171,14 +288,28 @@ class QueueService:
         )
         
         self._jobs[job_id] = job
-        self._result_queues[job_id] = asyncio.Queue()
+        self._result_queues[job_id] = ResultBuffer()
+        
+        # Results nobody comes to read are dropped rather than kept forever
+        asyncio.get_running_loop().call_later(RESULT_READER_TIMEOUT, self._reap_unread, job_id)
         
         await self._queue.put(job)
         
-        logger.info(f"Enqueued job {job_id} of type {task_type}")
+        logger.info("Enqueued job %s of type %s", job_id, task_type)
         
         return job
     
+    def _reap_unread(self, job_id: str):
+        """Close and forget a job's results if no reader has connected."""
+        result_buffer = self._result_queues.get(job_id)
+        if result_buffer is None or result_buffer.has_reader:
+            return
+        
+        del self._result_queues[job_id]
+        task = asyncio.create_task(result_buffer.close())
+        self._reapers.add(task)
+        task.add_done_callback(self._reapers.discard)
+    
     def get_job(self, job_id: str) -> Optional[Job]:
         """Get a job by ID."""
         return self._jobs.get(job_id)
@@ -187,31 +318,55 @@ class QueueService:
         """
         Get an async generator that yields job results as they become available.
         
-        This is used for SSE streaming of job results.
+        This is used for SSE streaming of job results. Chunks that arrive
+        while the client is still being written to are joined and yielded
+        together.
         """
         if job_id not in self._result_queues:
-            yield f"data: {{'error': 'Job not found'}}\n\n"
+            yield _JOB_NOT_FOUND_EVENT
             return
         
-        result_queue = self._result_queues[job_id]
+        result_buffer = self._result_queues[job_id]
+        result_buffer.has_reader = True
         
-        while True:
-            result = await result_queue.get()
-            
-            if result is None:  # End signal
-                break
-            
-            yield result
+        try:
+            while True:
+                batch = await result_buffer.drain()
+                
+                done = batch[-1] is None  # End signal
+                if done:
+                    batch.pop()
+                
+                if batch:
+                    yield b"".join(batch)
+                
+                if done:
+                    break
         
-        # Cleanup
-        del self._result_queues[job_id]
+        finally:
+            # Cleanup, also unblocking the worker if the client went away
+            await result_buffer.close()
+            self._result_queues.pop(job_id, None)
     
     async def shutdown(self):
         """Gracefully shutdown the queue service."""
-        self._shutdown = True
+        # Results nobody is reading would only hold the drain up
+        for job_id, result_buffer in list(self._result_queues.items()):
+            if not result_buffer.has_reader:
+                await result_buffer.close()
+                self._result_queues.pop(job_id, None)
         
-        # Wait for queue to be processed
-        await self._queue.join()
+        # Wait a bounded time for queued jobs to be processed, then stop
+        # the workers whether or not they are done
+        try:
+            await asyncio.wait_for(self._queue.join(), SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Queue shutdown timed out with %d jobs pending", self._queue.qsize())
+        
+        self._shutdown = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
         
         logger.info("Queue service shut down")
 
@@ -228,9 +383,9 @@ def get_queue_service() -> QueueService:
     return queue_service
 
 
-async def init_queue_service(max_workers: int = 3) -> QueueService:
+async def init_queue_service(max_workers: int = 3, queue_maxsize: int = 0) -> QueueService:
     """Initialize and start the global queue service."""
     global queue_service
-    queue_service = QueueService(max_workers=max_workers)
+    queue_service = QueueService(max_workers=max_workers, queue_maxsize=queue_maxsize)
     await queue_service.start_workers()
     return queue_service
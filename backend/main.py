@@ -4,52 +4,131 @@ Initializes the application with all routes and services.
 """
 
 import asyncio
-from contextlib import asynccontextmanager
+import os
+import multiprocessing
+import anyio
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
 import logging
-from fastapi import FastAPI
+import orjson
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 
 from app.config import get_settings
 from app.routes import chat_router, pdf_router
-from app.services import init_pdf_service, init_queue_service
+from app.services import close_ai_service, get_ai_service, init_pdf_service, init_queue_service
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    force=True
 )
 logger = logging.getLogger(__name__)
 
 
+class _ProbeAccessFilter(logging.Filter):
+    """Drop uvicorn access log records for health check probes."""
+    
+    PROBE_PATHS = frozenset({"/", "/health"})
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn.access args: (client, method, path, http_version, status)
+        args = record.args
+        return not (isinstance(args, tuple) and len(args) > 2 and args[2] in self.PROBE_PATHS)
+
+
+logging.getLogger("uvicorn.access").addFilter(_ProbeAccessFilter())
+
+settings = get_settings()
+
+# Chat job workers; the job queue holds up to 4 pending jobs per worker
+QUEUE_WORKERS = 3
+
+
+@asynccontextmanager
+async def pdf_lifespan(app: FastAPI):
+    """Run the PDF service and its CPU pool, loading the PDFs already in storage."""
+    # CPU-bound PDF parsing runs in worker processes so it never blocks the
+    # event loop serving HTTP and the queue workers. Workers are spawned
+    # rather than forked, so they don't inherit the loop and its sockets.
+    cpu_workers = os.cpu_count() or 1
+    app.state.cpu_pool = ProcessPoolExecutor(
+        max_workers=cpu_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+    try:
+        pdf_service = init_pdf_service(settings.pdf_storage_path, app.state.cpu_pool, cpu_workers)
+        await pdf_service.load_existing_pdfs()
+        logger.info("PDF service initialized with storage at: %s", settings.pdf_storage_path)
+        yield
+    finally:
+        app.state.cpu_pool.shutdown(wait=True)
+
+
+@asynccontextmanager
+async def queue_lifespan(app: FastAPI):
+    """Run the chat job queue workers, draining queued jobs on shutdown."""
+    queue_service = await init_queue_service(
+        max_workers=QUEUE_WORKERS,
+        queue_maxsize=QUEUE_WORKERS * 4
+    )
+    logger.info("Queue service initialized with %d workers", QUEUE_WORKERS)
+    try:
+        yield
+    finally:
+        await queue_service.shutdown()
+
+
+@asynccontextmanager
+async def ai_lifespan(app: FastAPI):
+    """Run the AI service's Groq connection pool."""
+    ai_service = get_ai_service()
+    # Prime the Groq connection pool without holding up startup
+    warmup_task = asyncio.create_task(ai_service.warmup())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+        await close_ai_service()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Application lifespan manager.
     Handles startup and shutdown events.
+    
+    Each service runs in its own sub-lifespan; they are torn down in
+    reverse order of startup.
     """
     # Startup
     logger.info("Starting AI Chat Assistant Backend...")
     
-    settings = get_settings()
+    # Raise the shared threadpool limit (default 40). Route handlers here are
+    # async, but FileResponse and UploadFile still run their file I/O in it.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_tokens
     
-    # Initialize PDF service
-    pdf_service = init_pdf_service(settings.pdf_storage_path)
-    await pdf_service.load_existing_pdfs()
-    logger.info(f"PDF service initialized with storage at: {settings.pdf_storage_path}")
+    async with AsyncExitStack() as stack:
+        # Queue workers call into the AI service, so it starts first and
+        # shuts down last
+        await stack.enter_async_context(ai_lifespan(app))
+        
+        # Queue workers submit PDF work to the CPU pool, so the queue starts
+        # after the PDF service and drains before the pool shuts down
+        await stack.enter_async_context(pdf_lifespan(app))
+        await stack.enter_async_context(queue_lifespan(app))
+        
+        logger.info("Backend startup complete!")
+        
+        yield
+        
+        # Shutdown
+        logger.info("Shutting down AI Chat Assistant Backend...")
     
-    # Initialize queue service
-    await init_queue_service(max_workers=3)
-    logger.info("Queue service initialized with 3 workers")
-    
-    logger.info("Backend startup complete!")
-    
-    yield
-    
-    # Shutdown
-    logger.info("Shutting down AI Chat Assistant Backend...")
-    from app.services import get_queue_service
-    queue_service = get_queue_service()
-    await queue_service.shutdown()
     logger.info("Backend shutdown complete!")
 
 
@@ -58,14 +137,27 @@ app = FastAPI(
     title="AI Chat Assistant API",
     description="Backend API for AI-powered chat with PDF citation support",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # API docs and schema are only served in debug
+    openapi_url="/openapi.json" if settings.debug else None,
+    docs_url="/docs" if settings.debug else None,
+    redoc_url="/redoc" if settings.debug else None
+)
+
+# Compress larger JSON responses. Added before CORS so CORS stays the
+# outermost layer. SSE streams are excluded by default, and PDFs are
+# already compressed internally.
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=1024,
+    compresslevel=5,
+    exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + ("application/pdf",)
 )
 
 # Configure CORS
-settings = get_settings()
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.cors_origins_list,
+    allow_origins=settings.cors_origins_set,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -76,35 +168,45 @@ app.include_router(chat_router, prefix="/api")
 app.include_router(pdf_router, prefix="/api")
 
 
+# Health check bodies never change, so they are serialized once
+_ROOT_BODY = orjson.dumps({
+    "status": "healthy",
+    "service": "AI Chat Assistant API",
+    "version": "1.0.0"
+})
+_HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "services": {
+        "api": "running",
+        "pdf_service": "running",
+        "queue_service": "running"
+    }
+})
+
+
 @app.get("/")
 async def root():
     """Root endpoint - health check."""
-    return {
-        "status": "healthy",
-        "service": "AI Chat Assistant API",
-        "version": "1.0.0"
-    }
+    return Response(_ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
     """Detailed health check endpoint."""
-    return {
-        "status": "healthy",
-        "services": {
-            "api": "running",
-            "pdf_service": "running",
-            "queue_service": "running"
-        }
-    }
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
-    settings = get_settings()
     uvicorn.run(
         "main:app",
         host=settings.host,
         port=settings.port,
-        reload=settings.debug
+        reload=settings.debug,
+        # Reload only works with a single process
+        workers=1 if settings.debug else settings.workers,
+        # C event loop and HTTP parser; asyncio in debug, as uvloop is
+        # unreliable under reload
+        loop="asyncio" if settings.debug else "uvloop",
+        http="httptools"
     )